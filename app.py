@@ -1,36 +1,63 @@
 # -*- coding: utf-8 -*-
-import os, io
+import os, io, csv, threading, base64, hashlib, hmac
 from datetime import datetime, date, timedelta
 from collections import defaultdict
+from itertools import accumulate
 from urllib.parse import urlencode
 
 from flask import (
-    Flask, render_template, request, redirect, url_for, flash, send_file, abort
+    Flask, render_template, request, redirect, url_for, flash, abort, Response, stream_with_context, g
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func, case, text
+from werkzeug.security import check_password_hash
+import bcrypt
+from sqlalchemy import select, update, inspect, bindparam, func, case, text, and_, or_, literal_column
+from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import ProgrammingError, OperationalError, NotSupportedError
+from sqlalchemy.engine.url import make_url
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
 # 加载 .env
 load_dotenv()
 
+# 直接 `python app.py` 即开发模式：统一通过 FLASK_DEBUG 开启 debug（模型定义时也要读到）
+if __name__ == "__main__":
+    os.environ.setdefault("FLASK_DEBUG", "1")
+
 def create_app():
     app = Flask(__name__, static_folder="static", template_folder="templates")
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-change-me")
-    db_url = os.getenv("DATABASE_URL", "sqlite:///data.db")
+    db_url = make_url(os.getenv("DATABASE_URL", "sqlite:///data.db"))
 
-    # 兼容 URL：postgres / postgresql → 使用 psycopg 驱动
-    if db_url.startswith("postgres://"):
-        db_url = db_url.replace("postgres://", "postgresql+psycopg://", 1)
-    elif db_url.startswith("postgresql://"):
-        db_url = db_url.replace("postgresql://", "postgresql+psycopg://", 1)
+    # 兼容 URL：postgres / postgresql → 使用 psycopg 驱动（已指定驱动的保持不变）
+    if db_url.drivername in ("postgres", "postgresql"):
+        db_url = db_url.set(drivername="postgresql+psycopg")
 
-    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    # str(URL) 会把密码替换成 ***，必须显式保留
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url.render_as_string(hide_password=False)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # 本应用只有小表单：限制请求体与表单内存，防止恶意大请求拖垮 worker
+    app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024
+    app.config["MAX_FORM_MEMORY_SIZE"] = 512 * 1024
+    if db_url.get_backend_name() != "sqlite":
+        # 显式连接池：不做 pre-ping（省去每次 checkout 的 SELECT 1，兼容 PgBouncer 事务池），
+        # 用 pool_recycle 定期换掉长连接；recycle 需小于 PgBouncer 的 server_idle_timeout
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": QueuePool,
+            "pool_size": 10,
+            "max_overflow": 5,
+            "pool_recycle": 60,
+            "pool_pre_ping": False,
+        }
+    # bcrypt 成本因子（每 +1 耗时翻倍），按机器性能调到单次哈希约 100ms
+    app.config["BCRYPT_ROUNDS"] = int(os.getenv("BCRYPT_ROUNDS", 12))
+    # 启动时自动建表/补索引（gunicorn 在 master 中执行，见 gunicorn.conf.py），设为 0 可关闭
+    app.config["AUTO_MIGRATE"] = os.getenv("AUTO_MIGRATE", "1") == "1"
     return app
 
 app = create_app()
@@ -46,15 +73,32 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(255), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 流水每次增删 +1，作为仪表盘缓存键的一部分，跨设备 / 跨 worker 失效
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    accounts = db.relationship("Account", back_populates="user", lazy=True, cascade="all, delete-orphan")
+    entries = db.relationship("Entry", back_populates="user", lazy=True, cascade="all, delete-orphan")
 
-    accounts = db.relationship("Account", backref="user", lazy=True, cascade="all, delete-orphan")
-    entries = db.relationship("Entry", backref="user", lazy=True, cascade="all, delete-orphan")
+    @staticmethod
+    def _bcrypt_input(password: str, salt: bytes) -> bytes:
+        # bcrypt 只接受 72 字节以内的输入（中文 3 字节/字），先做 HMAC-SHA256 + base64 定长为 44 字节；
+        # 以 bcrypt 盐为密钥（同 passlib bcrypt_sha256 v2），泄露的无盐 SHA-256 库无法直接拿来撞 bcrypt
+        return base64.b64encode(hmac.new(salt, password.encode(), hashlib.sha256).digest())
 
     def set_password(self, password: str):
-        self.password_hash = generate_password_hash(password)
+        salt = bcrypt.gensalt(rounds=app.config["BCRYPT_ROUNDS"])
+        self.password_hash = bcrypt.hashpw(self._bcrypt_input(password, salt), salt).decode()
 
     def check_password(self, password: str) -> bool:
-        return check_password_hash(self.password_hash, password)
+        # 兼容旧的 werkzeug（pbkdf2/scrypt）哈希：校验通过后升级为 bcrypt（由调用方提交）
+        if not self.password_hash.startswith("$2"):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        stored = self.password_hash.encode()
+        # "$2b$12$" + 22 位盐 = 前 29 个字符
+        return bcrypt.checkpw(self._bcrypt_input(password, stored[:29]), stored)
 
 class Account(db.Model):
     __tablename__ = "accounts"
@@ -63,13 +107,19 @@ class Account(db.Model):
     name = db.Column(db.String(100), nullable=False)
     initial_balance = db.Column(db.Float, default=0.0)
 
-    entries = db.relationship("Entry", backref="account", lazy=True)
+    user = db.relationship("User", back_populates="accounts")
+    entries = db.relationship("Entry", back_populates="account", lazy=True)
 
 class Entry(db.Model):
     __tablename__ = "entries"
+    # 热点查询都是 user_id = ? AND date 范围；复合索引的前缀已覆盖 user_id 单列查询
+    __table_args__ = (
+        db.Index("ix_entries_user_date", "user_id", "date"),
+        db.Index("ix_entries_user_account", "user_id", "account_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
-    date = db.Column(db.Date, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     direction = db.Column(db.String(10), nullable=False)  # 收入 / 支出
     amount = db.Column(db.Float, nullable=False)          # 原币金额（正数）
     fee = db.Column(db.Float, default=0.0)                # 原币手续费（正数）
@@ -82,10 +132,14 @@ class Entry(db.Model):
     net_cny = db.Column(db.Float, nullable=False)         # 以 CNY 计的净额（收入为正，支出为负；含手续费）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    user = db.relationship("User", back_populates="entries")
+    # 开发模式（FLASK_DEBUG=1）下禁止懒加载账户，及早暴露 N+1 查询
+    account = db.relationship("Account", back_populates="entries", lazy="raise" if app.debug else "select")
+
 # ------------------ 登录管理 ------------------
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 # ------------------ 工具函数 ------------------
 def compute_net_cny(direction: str, amount: float, fee: float, rate_to_cny: float) -> float:
@@ -96,23 +150,166 @@ def compute_net_cny(direction: str, amount: float, fee: float, rate_to_cny: floa
     else:
         return -amount_cny - fee_cny
 
+# 关键字搜索用的拼接字段；须与 ensure_db 中 ix_entries_keyword_trgm 的索引表达式保持一致。
+# 字段间用不可输入的控制字符 \x1f 分隔，关键字不会跨 类别/标签/备注 命中
+KEYWORD_SEP = "\x1f"
+KEYWORD_SQL = (
+    f"(coalesce(category, '') || '{KEYWORD_SEP}' || coalesce(tags, '')"
+    f" || '{KEYWORD_SEP}' || coalesce(note, ''))"
+)
+KEYWORD_EXPR = literal_column(KEYWORD_SQL)
+
+# 仪表盘聚合结果缓存：键为 (user_id, 日序号, 数据版本)，60 秒过期
+_dash_cache = TTLCache(maxsize=10_000, ttl=60)
+_dash_lock = threading.Lock()
+
+# 近 30 日的日期与图表标签，按天缓存（只保留今天/昨天两份）
+_LABEL_CACHE = {}
+_label_lock = threading.Lock()
+
+def last_30_days(today: date):
+    key = today.toordinal()
+    with _label_lock:
+        cached = _LABEL_CACHE.get(key)
+        if cached is None:
+            start_30 = today - timedelta(days=29)
+            days = [start_30 + timedelta(days=i) for i in range(30)]
+            cached = (days, [d.strftime("%m-%d") for d in days])
+            for k in [k for k in _LABEL_CACHE if k not in (key, key - 1)]:
+                _LABEL_CACHE.pop(k, None)
+            _LABEL_CACHE[key] = cached
+    return cached
+
+def request_today() -> date:
+    """本次请求统一使用的“今天”，首次调用时取值并存入 g。"""
+    if "today" not in g:
+        g.today = date.today()
+    return g.today
+
+def build_filters(args) -> list:
+    """由查询参数构造流水筛选条件（流水列表、页合计与导出共用）。"""
+    filters = [Entry.user_id == current_user.id]
+    start_date = args.get("start_date")
+    end_date = args.get("end_date")
+    keyword = args.get("kw")
+    direction = args.get("dir")
+    if start_date:
+        filters.append(Entry.date >= datetime.strptime(start_date, "%Y-%m-%d").date())
+    if end_date:
+        filters.append(Entry.date <= datetime.strptime(end_date, "%Y-%m-%d").date())
+    keyword = (keyword or "").replace(KEYWORD_SEP, "")
+    if keyword:
+        filters.append(KEYWORD_EXPR.ilike(bindparam("kw", f"%{keyword}%")))
+    if direction in ("收入", "支出"):
+        filters.append(Entry.direction == direction)
+    return filters
+
+def dashboard_stats(user_id: int, today: date) -> dict:
+    """仪表盘的 KPI 与图表数据（只读聚合，结果可缓存）。"""
+    start_7 = today - timedelta(days=6)
+    month_start = today.replace(day=1)
+    start_30 = today - timedelta(days=29)
+
+    # 一次按日聚合同时供给 今日/本周/本月 与 30 日曲线（31 号时月初早于 start_30）
+    rows = db.session.execute(
+        select(Entry.date, func.sum(Entry.net_cny)).where(
+            Entry.user_id == user_id,
+            Entry.date >= min(start_30, month_start),
+            Entry.date <= today
+        ).group_by(Entry.date).order_by(Entry.date.asc())
+    ).all()
+
+    daily_map = {r[0]: float(r[1]) for r in rows}
+    today_pl = daily_map.get(today, 0.0)
+    week_pl = sum(v for d, v in daily_map.items() if d >= start_7)
+    month_pl = sum(v for d, v in daily_map.items() if d >= month_start)
+
+    days_30, labels_30 = last_30_days(today)
+    raw_30 = [daily_map.get(dt, 0.0) for dt in days_30]
+    values_30 = [round(v, 2) for v in raw_30]
+    cum_values = [round(v, 2) for v in accumulate(raw_30)]
+
+    engine_name = db.engine.url.drivername
+    if engine_name.startswith("sqlite"):
+        month_expr = func.strftime("%Y-%m", Entry.date)
+    elif engine_name.startswith("postgresql"):
+        month_expr = func.to_char(Entry.date, "YYYY-MM")
+    else:
+        month_expr = func.substr(func.cast(Entry.date, db.String()), 1, 7)
+
+    six_months_ago = (today.replace(day=1) - timedelta(days=1)).replace(day=1) - timedelta(days=150)
+    month_rows = db.session.execute(
+        select(month_expr.label("ym"), func.sum(Entry.net_cny)).where(
+            Entry.user_id == user_id,
+            Entry.date >= six_months_ago
+        ).group_by(text("ym")).order_by(text("ym"))
+    ).all()
+
+    month_labels = [r[0] for r in month_rows]
+    month_values = [round(float(r[1] or 0.0), 2) for r in month_rows]
+
+    pos_sum = case((Entry.net_cny > 0, Entry.net_cny), else_=0.0)
+    cat_rows = db.session.execute(
+        select(Entry.category, func.sum(pos_sum)).where(
+            Entry.user_id == user_id
+        ).group_by(Entry.category)
+    ).all()
+    cat_labels = [r[0] or "未分类" for r in cat_rows]
+    cat_values = [round(float(r[1] or 0.0), 2) for r in cat_rows]
+
+    return {
+        "today_pl": round(today_pl, 2),
+        "week_pl": round(week_pl, 2),
+        "month_pl": round(month_pl, 2),
+        "labels_30": labels_30,
+        "values_30": values_30,
+        "cum_values": cum_values,
+        "month_labels": month_labels,
+        "month_values": month_values,
+        "cat_labels": cat_labels,
+        "cat_values": cat_values,
+    }
+
+def invalidate_dashboard(user_id: int):
+    # 在 SQL 里原子自增，与流水写入同一事务提交；所有设备与 worker 的旧缓存都不再命中
+    db.session.execute(
+        update(User).where(User.id == user_id).values(data_version=User.data_version + 1)
+    )
+
 def ensure_db():
     with app.app_context():
         db.create_all()
+        # create_all 不会给已存在的表补列/索引，这里手动迁移旧库
+        with db.engine.begin() as conn:
+            if "data_version" not in {c["name"] for c in inspect(conn).get_columns("users")}:
+                conn.execute(text("ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_entries_user_date ON entries (user_id, date)"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_entries_user_account ON entries (user_id, account_id)"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_entries_user_id"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_entries_date"))
+        if db.engine.url.get_backend_name() == "postgresql":
+            # 前置通配的 ILIKE 走 pg_trgm GIN 索引，避免全表扫描；
+            # 索引是可选优化：无权限建扩展或 pg_trgm 不可用时只记日志，搜索退回顺序扫描
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    # 旧索引用空格拼接，表达式已不匹配
+                    conn.execute(text("DROP INDEX IF EXISTS ix_entries_trgm"))
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_entries_keyword_trgm ON entries USING gin ({KEYWORD_SQL} gin_trgm_ops)"
+                    ))
+            except (ProgrammingError, OperationalError, NotSupportedError) as e:
+                app.logger.warning("pg_trgm index not created, keyword search will scan: %s", e)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """建表并执行迁移步骤：flask --app app init-db（可作部署前命令）。"""
+    ensure_db()
+    print("数据库已初始化。")
 
 @app.context_processor
 def inject_globals():
-    return {"today_str": date.today().isoformat()}
-
-# --- 在 WSGI (gunicorn) 模式下，首次请求自动建表 ---
-@app.before_request
-def _ensure_db_once():
-    if not getattr(app, "_db_inited", False):
-        try:
-            ensure_db()
-            app._db_inited = True
-        except Exception as e:
-            app.logger.error(f"DB init failed: {e}")
+    return {"today_str": request_today().isoformat()}
 
 # ------------------ 路由 ------------------
 @app.route("/")
@@ -135,7 +332,7 @@ def register():
         user = User(email=email)
         user.set_password(password)
         db.session.add(user)
-        db.session.commit()
+        db.session.flush()
         default_account = Account(user_id=user.id, name="默认账户", initial_balance=0.0)
         db.session.add(default_account)
         db.session.commit()
@@ -150,6 +347,8 @@ def login():
         password = request.form.get("password") or ""
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password):
+            if db.session.is_modified(user):
+                db.session.commit()  # 旧哈希已升级为 bcrypt
             login_user(user)
             flash("登录成功。", "success")
             return redirect(url_for("dashboard"))
@@ -168,9 +367,9 @@ def logout():
 @login_required
 def dashboard():
     if request.method == "POST":
+        d = request.form  # 放在 try 外，超限时直接返回 413
         try:
-            d = request.form
-            dt = datetime.strptime(d.get("date") or date.today().isoformat(), "%Y-%m-%d").date()
+            dt = datetime.strptime(d.get("date") or request_today().isoformat(), "%Y-%m-%d").date()
             direction = d.get("direction") or "支出"
             if direction not in ("收入", "支出"):
                 direction = "支出"
@@ -208,6 +407,7 @@ def dashboard():
                 net_cny=net_cny
             )
             db.session.add(entry)
+            invalidate_dashboard(current_user.id)
             db.session.commit()
             flash("已记录。", "success")
             return redirect(url_for("dashboard"))
@@ -215,116 +415,58 @@ def dashboard():
             db.session.rollback()
             flash(f"保存失败：{e}", "danger")
 
-    today = date.today()
-    start_7 = today - timedelta(days=6)
-    month_start = today.replace(day=1)
-
-    def sum_range(start_dt: date, end_dt: date):
-        q = db.session.query(func.coalesce(func.sum(Entry.net_cny), 0.0)).filter(
-            Entry.user_id == current_user.id,
-            Entry.date >= start_dt,
-            Entry.date <= end_dt
-        )
-        return float(q.scalar() or 0.0)
-
-    today_pl = sum_range(today, today)
-    week_pl = sum_range(start_7, today)
-    month_pl = sum_range(month_start, today)
-
-    start_30 = today - timedelta(days=29)
-    rows = db.session.query(Entry.date, func.sum(Entry.net_cny)).filter(
-        Entry.user_id == current_user.id,
-        Entry.date >= start_30,
-        Entry.date <= today
-    ).group_by(Entry.date).order_by(Entry.date.asc()).all()
-
-    daily_map = {r[0]: float(r[1]) for r in rows}
-    labels_30, values_30, cum_values = [], [], []
-    running = 0.0
-    for i in range(30):
-        dt = start_30 + timedelta(days=i)
-        labels_30.append(dt.strftime("%m-%d"))
-        v = daily_map.get(dt, 0.0)
-        values_30.append(round(v, 2))
-        running += v
-        cum_values.append(round(running, 2))
-
-    engine_name = db.engine.url.drivername
-    if engine_name.startswith("sqlite"):
-        month_expr = func.strftime("%Y-%m", Entry.date)
-    elif engine_name.startswith("postgresql"):
-        month_expr = func.to_char(Entry.date, "YYYY-MM")
-    else:
-        month_expr = func.substr(func.cast(Entry.date, db.String()), 1, 7)
-
-    six_months_ago = (today.replace(day=1) - timedelta(days=1)).replace(day=1) - timedelta(days=150)
-    month_rows = db.session.query(month_expr.label("ym"), func.sum(Entry.net_cny)).filter(
-        Entry.user_id == current_user.id,
-        Entry.date >= six_months_ago
-    ).group_by(text("ym")).order_by(text("ym")).all()
-
-    month_labels = [r[0] for r in month_rows]
-    month_values = [round(float(r[1] or 0.0), 2) for r in month_rows]
-
-    pos_sum = case((Entry.net_cny > 0, Entry.net_cny), else_=0.0)
-    cat_rows = db.session.query(Entry.category, func.sum(pos_sum)).filter(
-        Entry.user_id == current_user.id
-    ).group_by(Entry.category).all()
-    cat_labels = [r[0] or "未分类" for r in cat_rows]
-    cat_values = [round(float(r[1] or 0.0), 2) for r in cat_rows]
+    today = request_today()
+    key = (current_user.id, today.toordinal(), current_user.data_version)
+    with _dash_lock:
+        stats = _dash_cache.get(key)
+    if stats is None:
+        stats = dashboard_stats(current_user.id, today)
+        with _dash_lock:
+            _dash_cache[key] = stats
 
     accounts = Account.query.filter_by(user_id=current_user.id).order_by(Account.name.asc()).all()
 
-    return render_template(
-        "dashboard.html",
-        today_pl=round(today_pl, 2),
-        week_pl=round(week_pl, 2),
-        month_pl=round(month_pl, 2),
-        labels_30=labels_30,
-        values_30=values_30,
-        cum_values=cum_values,
-        month_labels=month_labels,
-        month_values=month_values,
-        cat_labels=cat_labels,
-        cat_values=cat_values,
-        accounts=accounts
-    )
+    return render_template("dashboard.html", accounts=accounts, **stats)
 
 @app.route("/entries")
 @login_required
 def entries():
-    page = int(request.args.get("page", 1))
     per_page = 20
-    q = Entry.query.filter_by(user_id=current_user.id)
-
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
-    keyword = request.args.get("kw")
-    direction = request.args.get("dir")
-    if start_date:
-        q = q.filter(Entry.date >= datetime.strptime(start_date, "%Y-%m-%d").date())
-    if end_date:
-        q = q.filter(Entry.date <= datetime.strptime(end_date, "%Y-%m-%d").date())
-    if keyword:
-        like = f"%{keyword}%"
-        q = q.filter(
-            (Entry.category.ilike(like)) | (Entry.tags.ilike(like)) | (Entry.note.ilike(like))
-        )
-    if direction in ("收入", "支出"):
-        q = q.filter(Entry.direction == direction)
-
-    q = q.order_by(Entry.date.desc(), Entry.id.desc())
-    pagination = db.paginate(q, page=page, per_page=per_page, error_out=False)
-    items = pagination.items
-
-    page_sum = round(sum([e.net_cny for e in items]) if items else 0.0, 2)
+    filters = build_filters(request.args)
+    q = Entry.query.options(joinedload(Entry.account).load_only(Account.name)).filter(*filters)
+
+    # keyset 分页：按 (date, id) 倒序，从上一页最后一条之后继续，避免 OFFSET 与 COUNT(*)
+    # 游标不完整或格式不对时忽略，从第一页开始
+    after_date = request.args.get("after_date")
+    after_id = request.args.get("after_id")
+    cursor_applied = False
+    if after_date and after_id and after_id.isdigit():
+        try:
+            ad = datetime.strptime(after_date, "%Y-%m-%d").date()
+        except ValueError:
+            ad = None
+        if ad is not None:
+            q = q.filter(or_(Entry.date < ad, and_(Entry.date == ad, Entry.id < int(after_id))))
+            cursor_applied = True
+
+    rows = q.order_by(Entry.date.desc(), Entry.id.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    params = {k: v for k, v in request.args.items() if k not in ("after_date", "after_id")}
+    next_params = None
+    if len(rows) > per_page:
+        next_params = dict(params, after_date=items[-1].date.isoformat(), after_id=items[-1].id)
+
+    filter_sum = db.session.execute(
+        select(func.coalesce(func.sum(Entry.net_cny), 0.0)).where(*filters)
+    ).scalar_one()
 
     return render_template(
         "entries.html",
         items=items,
-        pagination=pagination,
-        page_sum=page_sum,
-        params={k: v for k, v in request.args.items() if k != "page"}
+        next_params=next_params,
+        is_first_page=not cursor_applied,
+        filter_sum=round(float(filter_sum or 0.0), 2),
+        params=params
     )
 
 @app.route("/entries/<int:entry_id>/delete", methods=["POST"])
@@ -332,6 +474,7 @@ def entries():
 def delete_entry(entry_id):
     entry = Entry.query.filter_by(id=entry_id, user_id=current_user.id).first_or_404()
     db.session.delete(entry)
+    invalidate_dashboard(current_user.id)
     db.session.commit()
     flash("已删除。", "info")
     return redirect(request.referrer or url_for("entries"))
@@ -351,66 +494,68 @@ def accounts():
             flash("账户已创建。", "success")
             return redirect(url_for("accounts"))
 
+    # 余额直接在 SQL 里算好；用户条件留在 ON 中，没有流水的账户也保留
+    pl = func.coalesce(func.sum(Entry.net_cny), 0.0)
+    initial = func.coalesce(Account.initial_balance, 0.0)
     rows = db.session.query(
-        Account,
-        func.coalesce(func.sum(Entry.net_cny), 0.0).label("pl")
+        Account.id,
+        Account.name,
+        initial.label("initial_balance"),
+        pl.label("pl"),
+        (initial + pl).label("current_balance")
     ).outerjoin(Entry, (Entry.account_id == Account.id) & (Entry.user_id == current_user.id)).filter(
         Account.user_id == current_user.id
-    ).group_by(Account.id).order_by(Account.name.asc()).all()
-
-    acct_info = []
-    for acct, pl in rows:
-        cur = round((acct.initial_balance or 0.0) + float(pl or 0.0), 2)
-        acct_info.append({
-            "id": acct.id,
-            "name": acct.name,
-            "initial_balance": round(acct.initial_balance or 0.0, 2),
-            "pl": round(float(pl or 0.0), 2),
-            "current_balance": cur
-        })
-    return render_template("accounts.html", accounts=acct_info)
+    ).group_by(Account.id, Account.name, Account.initial_balance).order_by(Account.name.asc()).all()
+
+    return render_template("accounts.html", accounts=rows)
 
 @app.route("/export")
 @login_required
 def export_csv():
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date")
-
-    q = Entry.query.filter_by(user_id=current_user.id)
-    if start_date:
-        q = q.filter(Entry.date >= datetime.strptime(start_date, "%Y-%m-%d").date())
-    if end_date:
-        q = q.filter(Entry.date <= datetime.strptime(end_date, "%Y-%m-%d").date())
+    # 只取导出所需列，账户只带 name
+    q = Entry.query.options(
+        load_only(
+            Entry.date, Entry.direction, Entry.amount, Entry.fee, Entry.currency,
+            Entry.rate_to_cny, Entry.category, Entry.tags, Entry.note, Entry.net_cny
+        ),
+        joinedload(Entry.account).load_only(Account.name)
+    ).filter(*build_filters(request.args))
     q = q.order_by(Entry.date.asc(), Entry.id.asc())
 
-    output = []
     header = ["日期", "方向", "金额", "手续费", "币种", "汇率到CNY", "账户", "类别", "标签", "备注", "净额(CNY)"]
-    output.append(header)
-    for e in q.all():
-        acct_name = e.account.name if e.account else ""
-        output.append([
-            e.date.isoformat(),
-            e.direction,
-            f"{e.amount:.2f}",
-            f"{e.fee:.2f}",
-            e.currency,
-            f"{e.rate_to_cny:.4f}",
-            acct_name,
-            e.category or "",
-            e.tags or "",
-            e.note or "",
-            f"{e.net_cny:.2f}"
-        ])
-
-    buf = "\n".join([",".join(map(lambda x: f'"{x}"' if ("," in str(x) or '"' in str(x)) else str(x), row)) for row in output])
-    filename = f"export_{date.today().isoformat()}.csv"
-    return send_file(
-        io.BytesIO(buf.encode("utf-8-sig")),
+
+    def generate():
+        # 逐行写入并立即吐出，内存占用与导出行数无关
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(header)
+        yield "\ufeff" + buf.getvalue()
+        buf.seek(0); buf.truncate()
+        for e in q.yield_per(1000):
+            w.writerow([
+                e.date.isoformat(),
+                e.direction,
+                f"{e.amount:.2f}",
+                f"{e.fee:.2f}",
+                e.currency,
+                f"{e.rate_to_cny:.4f}",
+                e.account.name if e.account else "",
+                e.category or "",
+                e.tags or "",
+                e.note or "",
+                f"{e.net_cny:.2f}"
+            ])
+            yield buf.getvalue()
+            buf.seek(0); buf.truncate()
+
+    filename = f"export_{request_today().isoformat()}.csv"
+    return Response(
+        stream_with_context(generate()),
         mimetype="text/csv; charset=utf-8",
-        as_attachment=True,
-        download_name=filename
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 if __name__ == "__main__":
-    ensure_db()
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
+    if app.config["AUTO_MIGRATE"]:
+        ensure_db()
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=app.debug)
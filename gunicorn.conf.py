@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# gunicorn 会自动读取当前目录下的本文件
+
+def on_starting(server):
+    # 在 master 中建表/迁移一次，再 fork worker，避免多个 worker 并发执行 DDL；
+    # 失败直接抛出，gunicorn 启动失败而不是带着缺表的库继续服务
+    from app import app, db, ensure_db
+    if not app.config["AUTO_MIGRATE"]:
+        return
+    ensure_db()
+    # worker 由 master fork 而来，不要把 master 里的连接带过去
+    with app.app_context():
+        db.engine.dispose()